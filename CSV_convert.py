@@ -1,47 +1,97 @@
 import os
 import csv
 import sys
-import re
-import unicodedata
-
-def preprocessing_text(text):
-    text = re.sub('[\n\t]', ' ', text)
-    text = text.strip()
-    text = re.sub(' +', ' ', text)
-    text = ''.join(c for c in text if unicodedata.category(c) == 'Zs' or c.isprintable())
-    return text
-
-def convert_csv(csv_dir, output_dir):
-    total_files = len([file_name for file_name in os.listdir(csv_dir) if file_name.endswith('.csv')])
-    completed_files = 0
+import traceback
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from text_preprocessing import preprocessing_text, preprocessing_texts
+
+# Number of rows per Parquet/Arrow record batch
+BATCH_ROWS = 10000
+
+def argparser():
+    ap = ArgumentParser()
+    ap.add_argument('input_directory')
+    ap.add_argument('output_directory')
+    ap.add_argument('--processes', type=int, default=4, help='Number of processes to use')
+    ap.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv', help='Format of the *_converted files (parquet and arrow require pyarrow)')
+    return ap
+
+def get_record_batches(reader):
+    rows = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) == BATCH_ROWS:
+            yield get_record_batch(rows)
+            rows = []
+    if rows:
+        yield get_record_batch(rows)
+
+def get_record_batch(rows):
+    inputs = pyarrow.array(preprocessing_texts(row[1] for row in rows), pyarrow.string())
+    outputs = pyarrow.array(preprocessing_texts(row[2] for row in rows), pyarrow.string())
+    return pyarrow.record_batch([inputs, outputs], names=['input', 'output'])
+
+def convert_file(input_csv_path, output_path, output_format='csv'):
+    with open(input_csv_path, 'r', encoding='utf-8') as input_csv:
+        reader = csv.reader(input_csv)
+        header = next(reader)
+
+        if output_format == 'csv':
+            with open(output_path, 'w', encoding='utf-8') as output_csv:
+                output_writer = csv.writer(output_csv)
+
+                output_writer.writerow(['input', 'output'])
+
+                for row in reader:
+                    output_writer.writerow([preprocessing_text(row[1]), preprocessing_text(row[2])])
+        else:
+            schema = pyarrow.schema([('input', pyarrow.string()), ('output', pyarrow.string())])
+            if output_format == 'parquet':
+                writer = pyarrow.parquet.ParquetWriter(output_path, schema)
+            else:
+                writer = pyarrow.ipc.new_file(output_path, schema)
+            with writer:
+                for batch in get_record_batches(reader):
+                    writer.write_batch(batch)
+
+def convert_task(task):
+    file_name, input_csv_path, output_path, output_format = task
+    try:
+        convert_file(input_csv_path, output_path, output_format)
+    except Exception as e:
+        return file_name, f"Error processing {file_name}: {str(e)}\n{traceback.format_exc()}"
+    return file_name, None
+
+def convert_csv(csv_dir, output_dir, processes=1, output_format='csv'):
+    if output_format != 'csv' and pyarrow is None:
+        raise ImportError(f"the pyarrow package is required to write {output_format} files")
+    tasks = []
     for file_name in os.listdir(csv_dir):
         if file_name.endswith('.csv'):
             input_csv_path = os.path.join(csv_dir, file_name)
-            output_csv_path = os.path.join(output_dir, file_name.replace('.csv', '_converted.csv'))
-            
-            try:
-                with open(input_csv_path, 'r', encoding='utf-8') as input_csv, open(output_csv_path, 'w', encoding='utf-8') as output_csv:
-                    reader = csv.reader(input_csv)
-                    header = next(reader)
-                    output_writer = csv.writer(output_csv)
-                    
-                    output_writer.writerow(['input', 'output'])
-        
-                    for row in reader:
-                        output_writer.writerow([preprocessing_text(row[1]), preprocessing_text(row[2])])
-                
-                completed_files += 1
-                progress_percentage = (completed_files / total_files) * 100
-                print(f"Progress: {completed_files}/{total_files} files ({progress_percentage:.1f}%)")
-            except Exception as e:
-                print(f"Error processing {file_name}: {str(e)}")
-                import traceback
-                traceback.print_exc()
+            output_path = os.path.join(output_dir, file_name.replace('.csv', f'_converted.{output_format}'))
+            tasks.append((file_name, input_csv_path, output_path, output_format))
+    total_files = len(tasks)
+    completed_files = 0
+    with Pool(processes) as pool:
+        for file_name, error in pool.imap_unordered(convert_task, tasks):
+            if error is not None:
+                sys.stderr.write(error)
+                continue
+            completed_files += 1
+            progress_percentage = (completed_files / total_files) * 100
+            print(f"Progress: {completed_files}/{total_files} files ({progress_percentage:.1f}%)")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("-- Please use: python3 CSV_convert.py input_directory output_directory")
-    else:
-        csv_dir = sys.argv[1]
-        output_dir = sys.argv[2]
-        convert_csv(csv_dir, output_dir)
\ No newline at end of file
+    args = argparser().parse_args()
+    convert_csv(args.input_directory, args.output_directory, args.processes, args.format)
@@ -0,0 +1,243 @@
+import io
+import sys
+import gzip
+import json
+import queue
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BUFFER_SIZE = 1 << 20
+READ_BATCH_SIZE = 1 << 22
+WRITE_BATCH_SIZE = 1 << 22
+# Number of characters of a long string field encoded at a time by
+# write_streamed
+STREAM_CHUNK_CHARS = 1 << 20
+# Number of batches that can wait between the (de)compression thread and
+# the main thread
+QUEUE_SIZE = 8
+GZIP_LEVEL = 6
+
+def json_loads(s):
+    return json.loads(s)
+
+def json_dumpb(obj):
+    try:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    except UnicodeEncodeError:
+        # Lone surrogates can only be written escaped
+        return json.dumps(obj, separators=(',', ':')).encode('ascii')
+
+# The fast backends reject a few inputs that the json module accepts (lone
+# surrogates for instance), these fall back to the json module
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def loads(s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return json_loads(s)
+
+    def dumpb(obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            return json_dumpb(obj)
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def loads(s):
+        try:
+            return decoder.decode(s)
+        except msgspec.DecodeError:
+            return json_loads(s)
+
+    def dumpb(obj):
+        try:
+            return encoder.encode(obj)
+        except (TypeError, UnicodeEncodeError):
+            return json_dumpb(obj)
+else:
+    BACKEND = 'json'
+    loads = json_loads
+    dumpb = json_dumpb
+
+def dumps(obj):
+    return dumpb(obj).decode('utf-8')
+
+def is_compressed(fn):
+    return fn.endswith('.gz') or fn.endswith('.zst')
+
+def open_jsonl(fn, mode='rb'):
+    if fn.endswith('.gz'):
+        if 'w' in mode:
+            return gzip.open(fn, mode, compresslevel=GZIP_LEVEL)
+        return gzip.open(fn, mode)
+    if fn.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"the zstandard package is required to open {fn}")
+        if 'w' in mode:
+            return zstandard.open(fn, mode)
+        # The zstandard reader has no readline support of its own
+        return io.BufferedReader(zstandard.open(fn, mode), READ_BUFFER_SIZE)
+    return open(fn, mode, buffering=READ_BUFFER_SIZE)
+
+def read_batches(f, batch_size=READ_BATCH_SIZE):
+    # f is opened in binary mode, batch_size is a size hint in bytes
+    while True:
+        lines = f.readlines(batch_size)
+        if not lines:
+            return
+        yield lines
+
+def read_batches_threaded(f, batch_size=READ_BATCH_SIZE):
+    # Decompression runs in a background thread while the batches already
+    # read are processed
+    batches = queue.Queue(QUEUE_SIZE)
+    def read():
+        try:
+            for lines in read_batches(f, batch_size):
+                batches.put(lines)
+            batches.put(None)
+        except Exception as e:
+            batches.put(e)
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    while (lines := batches.get()) is not None:
+        if isinstance(lines, Exception):
+            raise lines
+        yield lines
+
+def read_file_batches(fn):
+    with open_jsonl(fn) as f:
+        if is_compressed(fn):
+            yield from read_batches_threaded(f)
+        else:
+            yield from read_batches(f)
+
+def read_lines(fn):
+    for lines in read_file_batches(fn):
+        yield from lines
+
+def iter_jsonl(f):
+    for lines in read_batches(f):
+        yield from map(loads, lines)
+
+def read_jsonl(fn):
+    for lines in read_file_batches(fn):
+        yield from map(loads, lines)
+
+class JSONLWriter:
+    def __init__(self, f, batch_size=WRITE_BATCH_SIZE, threaded=False):
+        self.f = f
+        self.batch_size = batch_size
+        self.batch = []
+        self.batch_len = 0
+        self.chunks = None
+        self.error = None
+        if threaded:
+            # Compression runs in a background thread while the next batch
+            # is being built
+            self.chunks = queue.Queue(QUEUE_SIZE)
+            self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def open(cls, fn):
+        if fn is None or fn == '-':
+            return cls(sys.stdout.buffer)
+        return cls(open_jsonl(fn, 'wb'), threaded=is_compressed(fn))
+
+    def write_chunks(self):
+        while (chunk := self.chunks.get()) is not None:
+            if self.error is None:
+                try:
+                    self.f.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+    def write_line(self, line):
+        self.batch.append(line)
+        self.batch.append(b'\n')
+        self.batch_len += len(line) + 1
+        if self.batch_len >= self.batch_size:
+            self.flush()
+
+    def write(self, obj):
+        self.write_line(dumpb(obj))
+
+    def write_bytes(self, chunk):
+        self.batch.append(chunk)
+        self.batch_len += len(chunk)
+        if self.batch_len >= self.batch_size:
+            self.flush()
+
+    def write_streamed(self, key, parts, fields):
+        # Writes the record {key: ''.join(parts), **fields} without building
+        # the joined string, the parts are encoded as they come. Long string
+        # fields are encoded by slices too
+        self.write_bytes(b'{' + dumpb(key) + b':"')
+        self.write_string_parts(parts)
+        for name, value in fields.items():
+            if isinstance(value, str) and len(value) > STREAM_CHUNK_CHARS:
+                self.write_bytes(b',' + dumpb(name) + b':"')
+                self.write_string_parts(value[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(value), STREAM_CHUNK_CHARS))
+            else:
+                self.write_bytes(b',' + dumpb(name) + b':' + dumpb(value))
+        self.write_bytes(b'}\n')
+
+    def write_string_parts(self, parts):
+        # Contents of a JSON string, the opening quote being already written
+        for part in parts:
+            self.write_bytes(dumpb(part)[1:-1])
+        self.write_bytes(b'"')
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        chunk = b''.join(self.batch)
+        self.batch = []
+        self.batch_len = 0
+        if self.chunks is not None:
+            self.chunks.put(chunk)
+        else:
+            self.f.write(chunk)
+            self.f.flush()
+
+    def close(self):
+        self.flush()
+        if self.chunks is not None:
+            self.chunks.put(None)
+            self.thread.join()
+            self.chunks = None
+            if self.error is not None:
+                raise self.error
+        if self.f is not sys.stdout.buffer:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_jsonl(fn, objs):
+    with JSONLWriter.open(fn) as writer:
+        for obj in objs:
+            writer.write(obj)
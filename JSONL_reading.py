@@ -1,5 +1,4 @@
 import sys
-import json
 import gzip
 import subprocess
 import os
@@ -8,6 +7,8 @@ import numpy as np
 
 from argparse import ArgumentParser
 
+import JSONL_io
+
 def argparser():
     ap = ArgumentParser()
     ap.add_argument('--output-dir', default='output')
@@ -16,9 +17,7 @@ def argparser():
     return ap
 
 def save(block, outfile):
-    with open(outfile, 'wt') as out_f:
-        for line in block:
-            out_f.write(json.dumps(line) + '\n')
+    JSONL_io.write_jsonl(outfile, block)
             
 def empty_dir(dir_name):
     for f in os.listdir(dir_name):
@@ -37,7 +36,7 @@ def main(argv):
     nb_line = args.nb_lines
     
     for n, fn in enumerate(args.jsonl):
-        with gzip.open(fn, 'rt') as f:
+        with gzip.open(fn, 'rb') as f:
             #cmd = f"zcat {fn} | wc -l"
             #output = subprocess.check_output(cmd, shell=True).decode('utf-8')
             #n_lines = int(output.strip())
@@ -48,8 +47,7 @@ def main(argv):
             
             index = 0
             block = []
-            for i, line in enumerate(f):
-                indata = json.loads(line)
+            for i, indata in enumerate(JSONL_io.iter_jsonl(f)):
                 block.append(indata)
                 if len(block) == nb_line:
                     outfile = os.path.join(args.output_dir, f"ecco_{nb_line*index}_{nb_line*(index+1)}.jsonl")
@@ -1,41 +1,50 @@
 import Levenshtein as LV
-import json
-import pandas as pd
 import csv
-import sys
 import os
 
 from glob import glob
 from tqdm import tqdm
+from argparse import ArgumentParser
 
 import OCR_errors_JSON_generator_functions as ocr
 
+def argparser():
+    ap = ArgumentParser()
+    ap.add_argument('input_directory')
+    ap.add_argument('output_jsonl')
+    ap.add_argument('charset_name')
+    ap.add_argument('--workers', type=int, default=1)
+    ap.add_argument('--long-pair-length', type=int, default=ocr.LONG_PAIR_LENGTH, help='Pairs longer than this many characters (e.g. 10000) are aligned between anchor words instead of as a whole; by default every pair is aligned as a whole')
+    ap.add_argument('--counts', help='JSONL file for the raw counts, to merge with other counts using OCR_errors_counts.py')
+    ocr.add_alignment_cache_arguments(ap)
+    ocr.add_convergence_arguments(ap)
+    return ap
+
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("-- Please use: python3 OCR_errors_JSON_generator.py input_directory output_jsonl charset_name")
-    else:
-        input_dir = sys.argv[1]
-        jsonl_name = sys.argv[2]
-        charset_name = sys.argv[3]
-        
-        json_content = {}
-        
-        csv_files = glob(os.path.join(input_dir, '*_converted.csv'))
-        dataframe = pd.concat([pd.read_csv(file) for file in tqdm(csv_files, desc="Dataframe creation", unit=" files")])
-        dataframe = dataframe.reset_index(drop=True)
-        
-        ocr.init_json_file(dataframe, json_content)
-        
-        with open(charset_name, 'r', encoding='utf-8') as charset:
-            while (char := charset.read(1)):
-                ocr.update_unknown_char(json_content, char, 1, 1)
-        
-        for index, row in tqdm(dataframe.iterrows(), total=len(dataframe), desc="Data processing   ", unit=" pairs"):
-            ocr.add_data_to_json(row['input'], row['output'], json_content)
-        
-        with open(jsonl_name, 'w', encoding='utf-8') as json_file:
-            json_file.write(json.dumps(json_content, indent=4))
-        
-        ocr.int_to_probabilities(jsonl_name)
-        #ocr.print_low_count(jsonl_name)
-        ocr.json2jsonl(jsonl_name, jsonl_name)
\ No newline at end of file
+    args = argparser().parse_args()
+    input_dir = args.input_directory
+    jsonl_name = args.output_jsonl
+    charset_name = args.charset_name
+    
+    json_content = {}
+    
+    converted_files = [file_name for extension in ('csv', 'parquet', 'arrow') for file_name in glob(os.path.join(input_dir, f'*_converted.{extension}'))]
+    
+    # The pairs are streamed from the files and the characters added as they
+    # are found
+    ocr.update_unknown_char(json_content, 'OTHER_CHAR')
+    
+    pairs = ocr.read_converted_pairs(converted_files)
+    if args.until_converged:
+        pairs = ocr.shuffle_pairs(pairs, args.shuffle_buffer, args.seed)
+    
+    with tqdm(desc="Data processing   ", unit=" pairs") as progress:
+        ocr.add_pairs_to_json(pairs, json_content, args.workers, progress, args.long_pair_length, ocr.get_convergence_monitor(args), args.alignment_cache, args.alignment_cache_size << 20)
+    
+    if args.counts is not None:
+        ocr.write_json_content(json_content, args.counts)
+    
+    ocr.add_charset(json_content, charset_name)
+    
+    #ocr.print_low_count(jsonl_name)
+    ocr.write_probabilities(json_content, jsonl_name)
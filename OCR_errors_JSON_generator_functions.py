@@ -3,7 +3,31 @@ import json
 import csv
 import os
 import sys
-import pandas as pd
+import re
+import random
+import itertools
+import numpy as np
+
+from bisect import bisect_left
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import JSONL_io
+import OCR_errors_alignment_cache as alignment_cache
+
+# Number of pairs counted by a worker at a time
+PAIRS_PER_TASK = 1000
+# Pairs with a text longer than this are aligned between anchor words;
+# None (or 0) aligns every pair as a whole with LV.editops
+LONG_PAIR_LENGTH = None
+WORD_RE = re.compile(r'\S+')
 
 def show_operators(ops, s1, s2):
     print("OPERATIONS:")
@@ -68,83 +92,429 @@ def update_unknown_char(json_content, char, keep=0.0, count=0):
         return True
     return False
 
-def init_json_file(dataframe, json_content):
-    contents = ''.join(dataframe['output'])
-    
-    unique_chars = set(contents)
-    
-    update_unknown_char(json_content, 'OTHER_CHAR')
-    
-    for char in unique_chars:
-        update_unknown_char(json_content, char)
-
-def update_known_char(json_content, char, op, error=None):
-    json_content[char]['COUNT'] += 1
-    json_content[char][op] += 1
-    json_content['OTHER_CHAR']['COUNT'] += 1
-    json_content['OTHER_CHAR'][op] += 1
-    
-    if op == 'REPLACE':
-        if error in json_content[char]['REPLACE_CHAR']:
-            json_content[char]['REPLACE_CHAR'][error] += 1
-        else:
-            json_content[char]['REPLACE_CHAR'][error] = 1
-        if error in json_content['OTHER_CHAR']['REPLACE_CHAR']:
-            json_content['OTHER_CHAR']['REPLACE_CHAR'][error] += 1
-        else:
-            json_content['OTHER_CHAR']['REPLACE_CHAR'][error] = 1
-            
-    elif op == 'INSERT':
-        if error in json_content[char]['INSERT_CHAR']:
-            json_content[char]['INSERT_CHAR'][error] += 1
-        else:
-            json_content[char]['INSERT_CHAR'][error] = 1
-        if error in json_content['OTHER_CHAR']['INSERT_CHAR']:
-            json_content['OTHER_CHAR']['INSERT_CHAR'][error] += 1
-        else:
-            json_content['OTHER_CHAR']['INSERT_CHAR'][error] = 1
-
 def char_section(char):
     if char != ' ':
         return char
     else:
         return ' ' # SPACE_CHAR
 
-def add_data_to_json(noised_text, text, json_content):
-    ops = LV.editops(text, noised_text)
-    nbr_char = len(text)
-    nbr_ops = len(ops)
-    
-    shift = 0
-    ops_index = 0
-   
-    for index in range(nbr_char):
-        if ops_index >= nbr_ops or ops[ops_index][1] != index:
-            update_known_char(json_content, char_section(text[index]), 'KEEP')
+# Columns of CountTable.ops, in the order of the JSON fields
+OPS = ('KEEP', 'DELETE', 'REPLACE', 'INSERT')
+KEEP, DELETE, REPLACE, INSERT = range(len(OPS))
+EDITOPS = {'delete': DELETE, 'replace': REPLACE, 'insert': INSERT}
+# Fields of the error characters of the REPLACE and INSERT operations
+ERROR_OPS = {REPLACE: 'REPLACE_CHAR', INSERT: 'INSERT_CHAR'}
+# (character, error character) pairs are stored as single keys
+CODE_BITS = 21
+CODE_MASK = (1 << CODE_BITS) - 1
+# Number of error keys buffered before they are reduced to counts
+ERROR_BUFFER_SIZE = 1 << 20
+
+def get_word_positions(text):
+    positions = {}
+    for match in WORD_RE.finditer(text):
+        positions.setdefault(match.group(), []).append(match.start())
+    return positions
+
+def get_increasing_chain(matches):
+    # Longest chain of the (spos, dpos, length) matches, sorted by spos, with
+    # increasing dpos
+    tails, tail_indices, previous = [], [], []
+    for k, (_, dpos, _) in enumerate(matches):
+        i = bisect_left(tails, dpos)
+        if i == len(tails):
+            tails.append(dpos)
+            tail_indices.append(k)
         else:
-            if ops[ops_index][0] == 'delete':
-                update_known_char(json_content, char_section(text[index]), 'DELETE')
-                shift -=1
-            elif ops[ops_index][0] == 'replace':
-                update_known_char(json_content, char_section(text[index]), 'REPLACE', char_section(noised_text[index+shift]))
+            tails[i] = dpos
+            tail_indices[i] = k
+        previous.append(tail_indices[i - 1] if i else None)
+    chain = []
+    k = tail_indices[-1] if tail_indices else None
+    while k is not None:
+        chain.append(matches[k])
+        k = previous[k]
+    return chain[::-1]
+
+def get_anchors(text, noised_text):
+    # Words found as many times in both texts, their occurrences being
+    # matched in order, then kept only where they are in the same order in
+    # both texts
+    noised_positions = get_word_positions(noised_text)
+    matches = []
+    for word, positions in get_word_positions(text).items():
+        if len(positions) == len(noised_positions.get(word, ())):
+            matches.extend((spos, dpos, len(word)) for spos, dpos in zip(positions, noised_positions[word]))
+    matches.sort()
+    return get_increasing_chain(matches)
+
+def is_long_pair(text, noised_text, long_pair_length=LONG_PAIR_LENGTH):
+    return bool(long_pair_length) and max(len(text), len(noised_text)) > long_pair_length
+
+def align(text, noised_text, long_pair_length=LONG_PAIR_LENGTH):
+    # Same ops as LV.editops(text, noised_text), but long pairs are only
+    # aligned in the gaps between anchors, which makes the cost close to
+    # linear when the anchors are dense
+    if not is_long_pair(text, noised_text, long_pair_length):
+        return LV.editops(text, noised_text)
+    ops = []
+    text_pos = noised_pos = 0
+    for spos, dpos, length in get_anchors(text, noised_text) + [(len(text), len(noised_text), 0)]:
+        for op, i, j in LV.editops(text[text_pos:spos], noised_text[noised_pos:dpos]):
+            ops.append((op, i + text_pos, j + noised_pos))
+        text_pos, noised_pos = spos + length, dpos + length
+    return ops
+
+def get_alignment_tag(text, noised_text, long_pair_length=LONG_PAIR_LENGTH):
+    # Identifies the way align() aligns the pair, for the alignment cache
+    method = 'anchored' if is_long_pair(text, noised_text, long_pair_length) else 'editops'
+    return f'{method} {LV.__version__}'
+
+def get_op_arrays(ops):
+    # (kinds, spos, dpos) arrays of LV.editops-like ops
+    if not ops:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    names, spos, dpos = zip(*ops)
+    kinds = np.fromiter(map(EDITOPS.__getitem__, names), dtype=np.int64, count=len(names))
+    return kinds, np.array(spos, dtype=np.int64), np.array(dpos, dtype=np.int64)
+
+def get_codes(text):
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.int64)
+
+def reduce_keys(keys, counts):
+    # Sums the counts of every key, keeping the keys in the order in which
+    # they were first seen
+    keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+    order = np.argsort(first, kind='stable')
+    return keys[order], counts[order]
+
+class CountTable:
+    # Operation counts of every character (indexed by code point) and
+    # counts of the (character, error character) pairs of the REPLACE and
+    # INSERT operations
+    def __init__(self):
+        self.ops = np.zeros((0, len(OPS)), dtype=np.int64)
+        self.errors = {op: ([], []) for op in ERROR_OPS}
+        self.buffered = dict.fromkeys(ERROR_OPS, 0)
+
+    def __getstate__(self):
+        # Only the rows of the characters seen are sent between processes
+        codes = np.flatnonzero(self.ops.any(axis=1))
+        return { 'codes': codes, 'rows': self.ops[codes], 'errors': {op: self.get_errors(op) for op in ERROR_OPS} }
+
+    def __setstate__(self, state):
+        self.__init__()
+        if len(state['codes']):
+            self.resize(int(state['codes'][-1]) + 1)
+            self.ops[state['codes']] = state['rows']
+        for op, (keys, counts) in state['errors'].items():
+            self.add_errors(op, keys, counts)
+
+    def resize(self, size):
+        if size > len(self.ops):
+            ops = np.zeros((max(size, 2 * len(self.ops)), len(OPS)), dtype=np.int64)
+            ops[:len(self.ops)] = self.ops
+            self.ops = ops
+
+    def add_errors(self, op, keys, counts):
+        keys_list, counts_list = self.errors[op]
+        keys_list.append(keys)
+        counts_list.append(counts)
+        self.buffered[op] += len(keys)
+        if self.buffered[op] >= ERROR_BUFFER_SIZE:
+            self.get_errors(op)
+
+    def get_errors(self, op):
+        keys_list, counts_list = self.errors[op]
+        if len(keys_list) != 1:
+            keys, counts = reduce_keys(np.concatenate(keys_list or [np.zeros(0, dtype=np.int64)]), np.concatenate(counts_list or [np.zeros(0, dtype=np.int64)]))
+            self.errors[op] = ([keys], [counts])
+            self.buffered[op] = len(keys)
+        return self.errors[op][0][0], self.errors[op][1][0]
+
+    def add_pair(self, noised_text, text, long_pair_length=LONG_PAIR_LENGTH):
+        self.add_ops(noised_text, text, *get_op_arrays(align(text, noised_text, long_pair_length)))
+
+    def add_ops(self, noised_text, text, kinds, spos, dpos):
+        codes = get_codes(text)
+        char_ops = np.full(len(codes), KEEP, dtype=np.int64)
+        if len(kinds):
+            # Each character gets at most one operation, and as with the
+            # former per-character loop, the characters following one with
+            # several operations are counted as kept
+            nbr_ops = np.searchsorted(spos, len(codes))
+            repeated = np.flatnonzero(spos[1:] == spos[:-1])
+            if len(repeated):
+                nbr_ops = min(nbr_ops, repeated[0] + 1)
+            kinds, spos, dpos = kinds[:nbr_ops], spos[:nbr_ops], dpos[:nbr_ops]
+            char_ops[spos] = kinds
+            noised_codes = get_codes(noised_text)
+            for op in ERROR_OPS:
+                selected = kinds == op
+                keys = (codes[spos[selected]] << CODE_BITS) | noised_codes[dpos[selected]]
+                self.add_errors(op, keys, np.ones(len(keys), dtype=np.int64))
+        if len(codes):
+            self.resize(int(codes.max()) + 1)
+            np.add.at(self.ops, (codes, char_ops), 1)
+
+    def merge(self, other):
+        self.resize(len(other.ops))
+        self.ops[:len(other.ops)] += other.ops
+        for op in ERROR_OPS:
+            self.add_errors(op, *other.get_errors(op))
+
+    def update_json(self, json_content):
+        update_unknown_char(json_content, 'OTHER_CHAR')
+        totals = self.ops.sum(axis=0)
+        for code in np.flatnonzero(self.ops.sum(axis=1)).tolist():
+            char = char_section(chr(code))
+            update_unknown_char(json_content, char)
+            for name, count in zip(OPS, self.ops[code].tolist()):
+                json_content[char][name] += count
+            json_content[char]['COUNT'] += sum(self.ops[code].tolist())
+        for name, count in zip(OPS, totals.tolist()):
+            json_content['OTHER_CHAR'][name] += count
+        json_content['OTHER_CHAR']['COUNT'] += int(totals.sum())
+        for op, name in ERROR_OPS.items():
+            keys, counts = self.get_errors(op)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                errors = json_content[char_section(chr(key >> CODE_BITS))][name]
+                error = char_section(chr(key & CODE_MASK))
+                errors[error] = errors.get(error, 0) + count
+                errors = json_content['OTHER_CHAR'][name]
+                errors[error] = errors.get(error, 0) + count
+
+def get_op_rates(ops):
+    # KEEP/DELETE/REPLACE/INSERT rates of every character
+    char_counts = ops.sum(axis=1)
+    return ops / np.maximum(char_counts, 1)[:, None], char_counts
+
+class ConvergenceMonitor:
+    # Compares the operation rates of the characters every checkpoint_pairs
+    # pairs. Once the change, weighted by the character frequencies, is
+    # under tolerance, only the pairs with characters seen less than
+    # min_char_count times are still counted, and the counting stops when
+    # there are none left
+    def __init__(self, tolerance, min_char_count, checkpoint_pairs):
+        self.tolerance = tolerance
+        self.min_char_count = min_char_count
+        self.checkpoint_pairs = checkpoint_pairs
+        self.nbr_pairs = 0
+        self.next_checkpoint = checkpoint_pairs
+        self.checkpoint_at = None
+        self.rates = None
+        self.char_counts = np.zeros(0, dtype=np.int64)
+        self.converged = False
+        self.done = False
+        self.skipped = 0
+
+    def is_needed(self, text):
+        if not self.converged:
+            return True
+        codes = get_codes(text)
+        if not len(codes) or codes.max() >= len(self.char_counts):
+            return True
+        return bool((self.char_counts[codes] < self.min_char_count).any())
+
+    def filter(self, pairs):
+        for noised_text, text in pairs:
+            if self.done:
+                return
+            if self.is_needed(text):
+                yield noised_text, text
             else:
-                update_known_char(json_content, char_section(text[index]), 'INSERT', char_section(noised_text[index+shift]))
-                shift += 1
-            ops_index += 1
+                self.skipped += 1
 
-def add_all_data_to_json(csv_name, json_content):
-    with open(csv_name, 'r', encoding='utf-8') as csv_file:
-        csv_reader = csv.reader(csv_file)
-        
-        header = next(csv_reader)
-        
-        for row in csv_reader:
-            add_data_to_json(row[0], row[1], json_content)
+    def add_pairs(self, counts, nbr_pairs):
+        self.nbr_pairs += nbr_pairs
+        if self.nbr_pairs >= self.next_checkpoint:
+            self.next_checkpoint = self.nbr_pairs + self.checkpoint_pairs
+            self.checkpoint(counts)
 
-def int_to_probabilities(json_name):
-    with open(json_name, 'r', encoding='utf-8') as json_file:
-        json_content = json.load(json_file)
-    
+    def finish(self, counts):
+        if self.checkpoint_at != self.nbr_pairs:
+            self.checkpoint(counts)
+
+    def checkpoint(self, counts):
+        self.checkpoint_at = self.nbr_pairs
+        rates, char_counts = get_op_rates(counts.ops)
+        nbr_rare = int(np.count_nonzero((char_counts > 0) & (char_counts < self.min_char_count)))
+        change = max_change = None
+        if self.rates is not None:
+            size = len(self.rates)
+            rate_changes = np.abs(rates[:size] - self.rates).max(axis=1)
+            # Characters first seen since the previous checkpoint count as
+            # fully changed
+            rate_changes[self.char_counts == 0] = 1.0
+            weights = char_counts[:size] / max(char_counts.sum(), 1)
+            change = float(weights @ rate_changes) + float(char_counts[size:].sum() / max(char_counts.sum(), 1))
+            sampled = self.char_counts >= self.min_char_count
+            max_change = float(rate_changes[sampled].max(initial=0.0))
+            if change < self.tolerance:
+                self.converged = True
+        self.rates = rates
+        self.char_counts = char_counts
+        if self.converged and nbr_rare == 0:
+            self.done = True
+        change = 'n/a' if change is None else f"{change:.6f} (largest {max_change:.6f})"
+        sys.stderr.write(f"Checkpoint: {self.nbr_pairs} pairs counted, {self.skipped} skipped, op rate change {change}, {nbr_rare} characters under {self.min_char_count} occurrences{', converged' if self.converged else ''}\n")
+
+def shuffle_pairs(pairs, buffer_size, seed=None):
+    # Approximate random order of a stream: every pair read replaces a
+    # random pair of the buffer, which is yielded
+    rng = random.Random(seed)
+    buffer = []
+    for pair in pairs:
+        if len(buffer) < buffer_size:
+            buffer.append(pair)
+        else:
+            i = rng.randrange(buffer_size)
+            yield buffer[i]
+            buffer[i] = pair
+    rng.shuffle(buffer)
+    yield from buffer
+
+def add_alignment_cache_arguments(ap):
+    ap.add_argument('--alignment-cache', help='SQLite file caching the alignments of the pairs between runs')
+    ap.add_argument('--alignment-cache-size', type=int, default=alignment_cache.CACHE_SIZE >> 20, help='Size in MB above which the least recently used alignments are removed from the cache')
+
+def add_convergence_arguments(ap):
+    ap.add_argument('--until-converged', action='store_true', help='Count the pairs in random order until the probabilities stop changing, then only the pairs with rare characters')
+    ap.add_argument('--tolerance', type=float, default=0.001, help='Change of the KEEP/DELETE/REPLACE/INSERT rates between checkpoints, weighted by the character frequencies, under which the estimation has converged')
+    ap.add_argument('--min-char-count', type=int, default=100, help='Occurrences under which a character is under-sampled')
+    ap.add_argument('--checkpoint-pairs', type=int, default=10000, help='Number of counted pairs between checkpoints; the pairs after a checkpoint are only read and filtered once it is done')
+    ap.add_argument('--shuffle-buffer', type=int, default=100000, help='Number of pairs buffered to randomize their order')
+    ap.add_argument('--seed', type=int, default=None)
+
+def get_convergence_monitor(args):
+    if not args.until_converged:
+        return None
+    return ConvergenceMonitor(args.tolerance, args.min_char_count, args.checkpoint_pairs)
+
+def count_pairs(pairs, long_pair_length=LONG_PAIR_LENGTH, cache_path=None, cache_size=alignment_cache.CACHE_SIZE):
+    counts = CountTable()
+    if cache_path is None:
+        for noised_text, text in pairs:
+            counts.add_pair(noised_text, text, long_pair_length)
+        return counts, len(pairs)
+    # The ops of the pairs already aligned are read from the cache, the
+    # others are aligned and saved
+    cache = alignment_cache.get_cache(cache_path, cache_size)
+    keys = [alignment_cache.get_key(text, noised_text, get_alignment_tag(text, noised_text, long_pair_length)) for noised_text, text in pairs]
+    cached_ops = cache.get_many(keys)
+    new_ops = {}
+    for key, (noised_text, text) in zip(keys, pairs):
+        ops = cached_ops.get(key) or new_ops.get(key)
+        if ops is None:
+            ops = new_ops[key] = get_op_arrays(align(text, noised_text, long_pair_length))
+        counts.add_ops(noised_text, text, *ops)
+    cache.put_many(new_ops, cached_ops)
+    return counts, len(pairs)
+
+def merge_all_counts(counts, results, progress=None, monitor=None):
+    # The counts are additive, merging the counts of consecutive chunks in
+    # order gives the same counts as counting all their pairs at once
+    for chunk_counts, nbr_pairs in results:
+        counts.merge(chunk_counts)
+        if progress is not None:
+            progress.update(nbr_pairs)
+        if monitor is not None:
+            monitor.add_pairs(counts, nbr_pairs)
+            if monitor.done:
+                break
+
+def get_pair_chunks(pairs, size=PAIRS_PER_TASK):
+    pairs = iter(pairs)
+    while (chunk := list(itertools.islice(pairs, size))):
+        yield chunk
+
+def add_pairs_to_json(pairs, json_content, workers=1, progress=None, long_pair_length=LONG_PAIR_LENGTH, monitor=None, cache_path=None, cache_size=alignment_cache.CACHE_SIZE):
+    # The pairs are counted by chunks in the worker processes and the local
+    # counts are merged here
+    counts = CountTable()
+    count_chunk = partial(count_pairs, long_pair_length=long_pair_length, cache_path=cache_path, cache_size=cache_size)
+    if workers > 1:
+        with Pool(workers) as pool:
+            count_all_pairs(counts, pairs, partial(pool.imap, count_chunk), progress, monitor)
+    else:
+        count_all_pairs(counts, pairs, partial(map, count_chunk), progress, monitor)
+    counts.update_json(json_content)
+
+def count_all_pairs(counts, pairs, count_chunks, progress=None, monitor=None):
+    if monitor is None:
+        merge_all_counts(counts, count_chunks(get_pair_chunks(pairs)), progress)
+        return
+    # The pairs up to the next checkpoint are only read once the previous
+    # checkpoint is done, so that they are filtered with its rates whatever
+    # the number of workers, and the chunks end at the checkpoints
+    pairs = monitor.filter(pairs)
+    while not monitor.done:
+        nbr_pairs = max(monitor.next_checkpoint - monitor.nbr_pairs, 1)
+        start = monitor.nbr_pairs
+        merge_all_counts(counts, count_chunks(get_pair_chunks(itertools.islice(pairs, nbr_pairs))), progress, monitor)
+        if monitor.nbr_pairs - start < nbr_pairs:
+            break
+    monitor.finish(counts)
+
+def read_csv_pairs(csv_files):
+    # Yields the (input, output) pairs of the converted CSV files one row at
+    # a time
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    for csv_name in csv_files:
+        with open(csv_name, 'r', encoding='utf-8', newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield row['input'], row['output']
+
+def read_record_batches(file_name):
+    # Parquet files are read by row groups, Arrow files are memory-mapped
+    # and their batches read without copying
+    if pyarrow is None:
+        raise ImportError(f"the pyarrow package is required to read {file_name}")
+    if file_name.endswith('.parquet'):
+        yield from pyarrow.parquet.ParquetFile(file_name).iter_batches(columns=['input', 'output'])
+    else:
+        with pyarrow.memory_map(file_name) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+def read_converted_pairs(file_names):
+    # Yields the (input, output) pairs of the files written by
+    # CSV_convert.py, whatever their format
+    for file_name in file_names:
+        if file_name.endswith('.csv'):
+            yield from read_csv_pairs([file_name])
+        else:
+            for batch in read_record_batches(file_name):
+                yield from zip(batch.column('input').to_pylist(), batch.column('output').to_pylist())
+
+def add_charset(json_content, charset_name):
+    # The characters of the charset never seen in the pairs are always kept
+    with open(charset_name, 'r', encoding='utf-8') as charset:
+        while (char := charset.read(1)):
+            update_unknown_char(json_content, char, 1, 1)
+
+def add_counts(json_content, counts):
+    # counts is a raw (not normalized) json_content, or part of one
+    for char, char_counts in counts.items():
+        update_unknown_char(json_content, char)
+        for op in ('KEEP', 'DELETE', 'REPLACE', 'INSERT', 'COUNT'):
+            json_content[char][op] += char_counts[op]
+        for op in ('REPLACE_CHAR', 'INSERT_CHAR'):
+            errors = json_content[char][op]
+            for error, count in char_counts[op].items():
+                errors[error] = errors.get(error, 0) + count
+
+def read_counts(counts_names):
+    json_content = {}
+    update_unknown_char(json_content, 'OTHER_CHAR')
+    for counts_name in counts_names:
+        for counts in JSONL_io.read_jsonl(counts_name):
+            add_counts(json_content, counts)
+    return json_content
+
+def normalize_counts(json_content):
     for char in json_content:
         json_content[char]['KEEP'] /= json_content[char]['COUNT']
         nbr_modification = json_content[char]['DELETE']+json_content[char]['REPLACE']+json_content[char]['INSERT']
@@ -159,11 +529,25 @@ def int_to_probabilities(json_name):
         
             for op in ('DELETE', 'REPLACE', 'INSERT'):
                 json_content[char][op] /= nbr_modification
+    return json_content
+
+def int_to_probabilities(json_name):
+    with open(json_name, 'r', encoding='utf-8') as json_file:
+        json_content = json.load(json_file)
+    
+    normalize_counts(json_content)
     
     with open(json_name, 'w', encoding='utf-8') as json_file:
         json_object = json.dumps(json_content, indent=4)
         json_file.write(json_object)
 
+def write_json_content(json_content, jsonl_name):
+    JSONL_io.write_jsonl(jsonl_name, ({obj_name: json_content[obj_name]} for obj_name in json_content))
+
+def write_probabilities(json_content, jsonl_name):
+    # Normalizes json_content in place
+    write_json_content(normalize_counts(json_content), jsonl_name)
+
 def print_low_count(json_name):
     with open(json_name, 'r', encoding='utf-8') as json_file:
         json_content = json.load(json_file)
@@ -182,7 +566,4 @@ def json2jsonl(json_name, jsonl_name):
     with open(json_name, 'r', encoding='utf-8') as json_file:
         json_content = json.load(json_file)
     
-    with open(jsonl_name, 'w', encoding='utf-8') as jsonl_file:
-        for obj_name in json_content:
-            obj = {obj_name: json_content[obj_name]}
-            jsonl_file.write(json.dumps(obj) + '\n')
\ No newline at end of file
+    write_json_content(json_content, jsonl_name)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import time
+import sqlite3
+import hashlib
+
+import numpy as np
+
+# Default bound of the cache file size, in bytes
+CACHE_SIZE = 1 << 30
+# Share of the cache removed at a time, least recently used first, until it
+# fits in its maximum size again
+EVICTION_SHARE = 0.1
+# Number of keys per SELECT
+QUERY_SIZE = 500
+
+def pack_ops(kinds, spos, dpos):
+    return spos.astype(np.int32).tobytes() + dpos.astype(np.int32).tobytes() + kinds.astype(np.int8).tobytes()
+
+def unpack_ops(data):
+    n = len(data) // 9
+    spos = np.frombuffer(data, dtype=np.int32, count=n).astype(np.int64)
+    dpos = np.frombuffer(data, dtype=np.int32, count=n, offset=4 * n).astype(np.int64)
+    kinds = np.frombuffer(data, dtype=np.int8, count=n, offset=8 * n).astype(np.int64)
+    return kinds, spos, dpos
+
+def get_key(text, noised_text, tag):
+    # The tag identifies the alignment method, the same pair aligned
+    # differently is cached separately
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{tag}\0{len(text)}\0".encode('utf-8'))
+    digest.update(text.encode('utf-8', 'surrogatepass'))
+    digest.update(noised_text.encode('utf-8', 'surrogatepass'))
+    return digest.digest()
+
+class AlignmentCache:
+    # Edit operations of the aligned pairs, as (kinds, spos, dpos) arrays,
+    # stored in an SQLite file shared by the worker processes
+    def __init__(self, path, max_size=CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS alignments (key BLOB PRIMARY KEY, ops BLOB NOT NULL, used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS alignments_used ON alignments (used)')
+        self.db.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(set(keys))
+        for i in range(0, len(keys), QUERY_SIZE):
+            batch = keys[i:i + QUERY_SIZE]
+            query = f"SELECT key, ops FROM alignments WHERE key IN ({','.join('?' * len(batch))})"
+            for key, data in self.db.execute(query, batch):
+                found[key] = unpack_ops(data)
+        return found
+
+    def put_many(self, ops, used_keys=()):
+        # Saves the new ops and marks the keys found in the cache as used
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO alignments VALUES (?, ?, ?)', ((key, pack_ops(*key_ops), now) for key, key_ops in ops.items()))
+            self.db.executemany('UPDATE alignments SET used = ? WHERE key = ?', ((now, key) for key in used_keys))
+        if ops and self.get_size() > self.max_size:
+            self.evict()
+
+    def get_size(self):
+        page_size, = self.db.execute('PRAGMA page_size').fetchone()
+        page_count, = self.db.execute('PRAGMA page_count').fetchone()
+        freelist_count, = self.db.execute('PRAGMA freelist_count').fetchone()
+        return (page_count - freelist_count) * page_size
+
+    def evict(self):
+        # Removes the least recently used alignments until the cache fits in
+        # max_size again. The freed pages are reused by the next insertions,
+        # the file itself does not shrink
+        with self.db:
+            count, = self.db.execute('SELECT COUNT(*) FROM alignments').fetchone()
+            while count > 0 and self.get_size() > self.max_size:
+                removed = max(int(count * EVICTION_SHARE), 1)
+                self.db.execute('DELETE FROM alignments WHERE key IN (SELECT key FROM alignments ORDER BY used LIMIT ?)', (removed,))
+                count -= removed
+
+    def close(self):
+        self.db.close()
+
+# One connection per process and cache file
+caches = {}
+
+def get_cache(path, max_size=CACHE_SIZE):
+    if path not in caches:
+        caches[path] = AlignmentCache(path, max_size)
+    return caches[path]
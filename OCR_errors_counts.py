@@ -0,0 +1,32 @@
+import sys
+
+from argparse import ArgumentParser
+
+import OCR_errors_JSON_generator_functions as ocr
+
+def argparser():
+    ap = ArgumentParser(description='Combine the raw counts written by the estimators with --counts')
+    commands = ap.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge', help='Add count files together into a new count file')
+    merge.add_argument('counts', nargs='+')
+    merge.add_argument('--output', required=True)
+    finalize = commands.add_parser('finalize', help='Add count files together and normalize them into a probabilities file for OCR_noise.py')
+    finalize.add_argument('counts', nargs='+')
+    finalize.add_argument('--charset', help='Characters to add as always kept when they are in none of the count files')
+    finalize.add_argument('--output-jsonl', required=True)
+    return ap
+
+def main(argv):
+    args = argparser().parse_args()
+
+    json_content = ocr.read_counts(args.counts)
+
+    if args.command == 'merge':
+        ocr.write_json_content(json_content, args.output)
+    else:
+        if args.charset is not None:
+            ocr.add_charset(json_content, args.charset)
+        ocr.write_probabilities(json_content, args.output_jsonl)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
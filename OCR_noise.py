@@ -1,16 +1,25 @@
+import os
 import sys
 import json
+import time
+import hashlib
 
 import numpy as np
 
 from string import ascii_letters, digits, punctuation
 from argparse import ArgumentParser
+from multiprocessing import Pool
 from tqdm import tqdm
 
+import JSONL_io
+
+from OCR_noise_model import NoiseModel, REPLACE, INSERT, NO_CHAR, get_codes, get_text
+from OCR_noise_stats import NoiseStats
+
 # Default set of characters that can be substituted for
 DEFAULT_CHARSET = ascii_letters + digits + punctuation + ' '
 
-def argparser():
+def argparser(inputs=True):
     ap = ArgumentParser()
     ap.add_argument('--seed', type=int, default=None)
     ap.add_argument('--mean', type=float, default=0.1)
@@ -24,49 +33,55 @@ def argparser():
     ap.add_argument('--min-block-size', type=int, default=500)
     ap.add_argument('--max-block-size', type=int, default=2000)
     ap.add_argument('--other-char-prob', type=float, default=0.05)
-    ap.add_argument('jsonl', nargs='+')
+    ap.add_argument('--engine', choices=['loop', 'vectorized'], default='loop')
+    ap.add_argument('--workers', type=int, default=1)
+    ap.add_argument('--output', default='-')
+    ap.add_argument('--variants', type=int, default=1)
+    ap.add_argument('--stats', help='JSON file for noise and throughput statistics')
+    ap.add_argument('--no-model-cache', dest='model_cache', action='store_false', help='Do not load or save the compiled model next to the --charset-probs file')
+    ap.add_argument('--stream', action='store_true', help='Write every noised block as soon as it is done (bounds the memory used by book-length documents)')
+    if inputs:
+        ap.add_argument('jsonl', nargs='+')
     return ap
 
-def get_op_char(rng, args, char, op, probs_dict, other_chars):
-    if rng.random() < args.other_char_prob:
-        return get_other_char(rng, other_chars)
-    cumu_p = 0
-    p_char = rng.random()
-    for c in probs_dict[char][op + '_CHAR']:
-        cumu_p += probs_dict[char][op + '_CHAR'][c]
-        if p_char <= cumu_p:
-            if c != 'SPACE_CHAR':
-                return c
-            return ' '
-    return char
-
-def get_other_char(rng, other_chars):
-    other_char = rng.choice(other_chars)
-    if other_char != 'SPACE_CHAR':
-        return other_char
-    return ' '
+def get_op_char(rng, model, i, c, op, stats=None):
+    if rng.random() < model.other_char_prob:
+        if stats is not None:
+            stats.other_chars += 1
+        return get_other_char(rng, model)
+    code = model.sample_op_char(rng, op, i)
+    if code != NO_CHAR:
+        return chr(code)
+    return c
+
+def get_op_codes(rng, model, rows, op, stats=None):
+    other = rng.random(len(rows)) < model.other_char_prob
+    op_codes = model.sample_op_codes(rng, op, rows)
+    n_other = np.count_nonzero(other)
+    if n_other:
+        op_codes[other] = model.sample_other_codes(rng, n_other)
+        if stats is not None:
+            stats.other_chars += int(n_other)
+    return op_codes
+
+def get_other_char(rng, model):
+    return chr(model.sample_other_char(rng))
 
 def set_default_char(args):
     if args.charset == None:
         return [c for c in DEFAULT_CHARSET]
     else:
-        charset = []
         with open(args.charset) as f:
-            content = f.read()
-            for c in content:
-                charset.append(c)
-        return charset
+            return list(f.read())
 
 def set_other_chars(probs_dict, default_charset):
-    for other_char in probs_dict:
-        if other_char != 'OTHER_CHAR' and other_char not in default_charset:
-            default_charset.append(other_char)
-    for other_char in probs_dict['OTHER_CHAR']['REPLACE_CHAR']:
-        if other_char not in default_charset:
-            default_charset.append(other_char)
-    for other_char in probs_dict['OTHER_CHAR']['INSERT_CHAR']:
-        if other_char not in default_charset:
-            default_charset.append(other_char)
+    known_chars = set(default_charset)
+    known_chars.add('OTHER_CHAR')
+    for other_chars in (probs_dict, probs_dict['OTHER_CHAR']['REPLACE_CHAR'], probs_dict['OTHER_CHAR']['INSERT_CHAR']):
+        for other_char in other_chars:
+            if other_char not in known_chars:
+                known_chars.add(other_char)
+                default_charset.append(other_char)
     return sorted(default_charset)
 
 def set_prob(rng, args):
@@ -74,83 +89,322 @@ def set_prob(rng, args):
     prob = min(max(prob, args.min_error_prob), args.max_error_prob)
     return prob
 
-def generate_block_sizes(text, text_len, min_block_size, max_block_size):
-    rng = np.random.default_rng()
-    block_sizes = []
-    remaining_len = text_len
+def get_space_positions(codes):
+    return np.flatnonzero(codes == 32)
+
+def generate_block_sizes(rng, text_len, min_block_size, max_block_size):
+    # Every block but the last one is at least max(min_block_size, 1) long,
+    # so this many sizes are always enough
+    return rng.integers(min_block_size, max_block_size, size=text_len // max(min_block_size, 1) + 1)
+
+def generate_block_bounds(rng, text_len, space_positions, min_block_size, max_block_size):
+    block_sizes = generate_block_sizes(rng, text_len, min_block_size, max_block_size)
+    block_bounds = [0]
     text_pos = 0
-    while remaining_len > 0:
-        block_size = rng.integers(min_block_size, max_block_size)
-        if block_size > remaining_len:
-            block_size = remaining_len
-        space_pos = text.find(' ', text_pos + block_size)
-        if space_pos != -1:
-            block_size = space_pos - text_pos + 1
+    for block_size in block_sizes:
+        if text_pos >= text_len:
+            break
+        block_size = min(block_size, text_len - text_pos)
+        space_index = np.searchsorted(space_positions, text_pos + block_size)
+        if space_index < len(space_positions):
+            text_pos = int(space_positions[space_index]) + 1
         else:
-            block_size = remaining_len
-        block_sizes.append(block_size)
-        remaining_len -= block_size
-        text_pos += block_size
-    return block_sizes
+            text_pos = text_len
+        block_bounds.append(text_pos)
+    return block_bounds
 
+def iter_text_blocks(rng, text, min_block_size, max_block_size):
+    # Same blocks as generate_block_bounds, but the spaces are searched in
+    # the text one block at a time instead of being listed beforehand
+    text_len = len(text)
+    text_pos = 0
+    for block_size in generate_block_sizes(rng, text_len, min_block_size, max_block_size):
+        if text_pos >= text_len:
+            break
+        block_start = text_pos
+        space_pos = text.find(' ', text_pos + min(int(block_size), text_len - text_pos))
+        text_pos = text_len if space_pos == -1 else space_pos + 1
+        yield block_start, text_pos
 
-def generate_blocks(text, block_sizes):
-    blocks = []
-    start = 0
-    for block_size in block_sizes:
-        end = start + block_size
-        blocks.append(text[start:end])
-        start = end
-    return blocks
+def prepare_text(text):
+    # Per-document precomputation shared by all the variants of a document
+    codes = get_codes(text)
+    return codes, get_space_positions(codes)
 
-def get_working_char(c, probs_dict):
-    if c not in probs_dict:
-        return 'OTHER_CHAR'
-    else:
-        if probs_dict[c]['KEEP'] == 1:
-            return 'OTHER_CHAR'
-        else:
-            return c
+def generate_blocks(rng, text, args, prepared=None):
+    if prepared is None:
+        return iter_text_blocks(rng, text, args.min_block_size, args.max_block_size)
+    codes, space_positions = prepared
+    block_bounds = generate_block_bounds(rng, len(codes), space_positions, args.min_block_size, args.max_block_size)
+    return zip(block_bounds[:-1], block_bounds[1:])
 
-def add_noise(text, rng, args, probs_dict, other_chars):
-    block_sizes = generate_block_sizes(text, len(text), args.min_block_size, args.max_block_size)
-    blocks = generate_blocks(text, block_sizes)
-    
-    chars = []
-    
-    for text_block in blocks:
+def iter_noise(text, rng, args, model, prepared=None, stats=None):
+    for block_start, block_end in generate_blocks(rng, text, args, prepared):
+        text_block = text[block_start:block_end]
+        chars = []
         prob = set_prob(rng, args)
+        deleted = replaced = inserted = 0
         for c in text_block:
-            working_c = get_working_char(c, probs_dict)
-            if rng.random() > prob * probs_dict[working_c]['KEEP']:
+            i = model.get_index(c)
+            if rng.random() > prob * model.keep[i]:
                 chars.append(c)
             else:
                 p_op = rng.random()
-                if p_op < probs_dict[working_c]['DELETE']:
-                    pass
-                elif p_op < (probs_dict[working_c]['DELETE'] + probs_dict[working_c]['REPLACE']):
-                    chars.append(get_op_char(rng, args, working_c, 'REPLACE', probs_dict, other_chars))
+                if p_op < model.delete[i]:
+                    deleted += 1
+                elif p_op < model.delete_replace[i]:
+                    replaced += 1
+                    chars.append(get_op_char(rng, model, i, c, REPLACE, stats))
                 else:
-                    chars.append(get_op_char(rng, args, working_c, 'INSERT', probs_dict, other_chars))
+                    inserted += 1
+                    chars.append(get_op_char(rng, model, i, c, INSERT, stats))
                     chars.append(c)
-            
-    return ''.join(chars)
+        if stats is not None:
+            stats.add_block(len(text_block), deleted, replaced, inserted)
+        yield ''.join(chars)
+
+def add_noise(text, rng, args, model, prepared=None, stats=None):
+    return ''.join(iter_noise(text, rng, args, model, prepared, stats))
+
+def noise_codes(codes, prob, rng, model, stats=None):
+    indices = model.get_indices(codes)
+    modified = np.flatnonzero(rng.random(len(codes)) <= prob * model.keep[indices])
+    p_ops = rng.random(len(modified))
+    modified_indices = indices[modified]
+    deleted = p_ops < model.delete[modified_indices]
+    replaced = ~deleted & (p_ops < model.delete_replace[modified_indices])
+    inserted = ~deleted & ~replaced
+    op_codes = np.empty(len(modified), dtype=np.uint32)
+    op_codes[replaced] = get_op_codes(rng, model, modified_indices[replaced], REPLACE, stats)
+    op_codes[inserted] = get_op_codes(rng, model, modified_indices[inserted], INSERT, stats)
+    kept = op_codes == NO_CHAR
+    op_codes[kept] = codes[modified[kept]]
+    if stats is not None:
+        stats.add_block(len(codes), np.count_nonzero(deleted), np.count_nonzero(replaced), np.count_nonzero(inserted))
+    # Every character is copied once, deleted ones zero times and the ones
+    # with an insertion twice, the first copy being then overwritten
+    counts = np.ones(len(codes), dtype=np.int64)
+    counts[modified[deleted]] = 0
+    counts[modified[inserted]] = 2
+    noised = np.repeat(codes, counts)
+    ends = np.cumsum(counts)
+    noised[ends[modified[replaced]] - 1] = op_codes[replaced]
+    noised[ends[modified[inserted]] - 2] = op_codes[inserted]
+    return noised
+
+def iter_noise_codes(text, rng, args, model, prepared=None, stats=None):
+    # Without a prepared text, every block is converted to code points on
+    # its own
+    for block_start, block_end in generate_blocks(rng, text, args, prepared):
+        if prepared is None:
+            codes = get_codes(text[block_start:block_end])
+        else:
+            codes = prepared[0][block_start:block_end]
+        prob = set_prob(rng, args)
+        yield noise_codes(codes, prob, rng, model, stats)
+
+def iter_noise_vectorized(text, rng, args, model, prepared=None, stats=None):
+    for noised in iter_noise_codes(text, rng, args, model, prepared, stats):
+        yield get_text(noised)
+
+def add_noise_vectorized(text, rng, args, model, prepared=None, stats=None):
+    blocks = list(iter_noise_codes(text, rng, args, model, prepared, stats))
+    if not blocks:
+        return ''
+    return get_text(np.concatenate(blocks))
+
+ENGINES = {
+    'loop': add_noise,
+    'vectorized': add_noise_vectorized,
+}
+
+# Engines yielding the noised text block by block
+BLOCK_ENGINES = {
+    'loop': iter_noise,
+    'vectorized': iter_noise_vectorized,
+}
+
+def load_probs_dict(charset_probs):
+    probs_dict = {}
+    for data in JSONL_io.read_jsonl(charset_probs):
+        char = list(data.keys())[0]
+        probs_dict[char] = data[char]
+    return probs_dict
+
+def build_model(args):
+    probs_dict = load_probs_dict(args.charset_probs)
+    default_charset = set_default_char(args)
+    other_chars = set_other_chars(probs_dict, default_charset)
+    return NoiseModel(probs_dict, other_chars, args.other_char_prob)
+
+def get_model_cache_path(args):
+    # The compiled model is cached next to the probabilities file, under a
+    # name depending on everything it is built from
+    digest = hashlib.sha256()
+    with open(args.charset_probs, 'rb') as f:
+        digest.update(f.read())
+    if args.charset is None:
+        digest.update(DEFAULT_CHARSET.encode('utf-8'))
+    else:
+        with open(args.charset, 'rb') as f:
+            digest.update(f.read())
+    digest.update(repr(args.other_char_prob).encode('utf-8'))
+    return f'{args.charset_probs}.{digest.hexdigest()[:16]}.noisemodel'
+
+def load_model(args):
+    if not args.model_cache:
+        return build_model(args)
+    path = get_model_cache_path(args)
+    if os.path.exists(path):
+        return NoiseModel.load(path)
+    model = build_model(args)
+    try:
+        model.save(path)
+    except OSError as e:
+        sys.stderr.write(f"Could not cache the noise model in {path}: {e}\n")
+    return model
+
+class OCRNoiser:
+    # Noises texts on the fly, e.g. in a data loader:
+    #   noiser = OCRNoiser('data_files/ecco_i/ecco_i_probs.jsonl', charset='data_files/ecco_charset.txt', engine='vectorized')
+    #   noised = noiser.noise(text)
+    # The options are those of the command line (mean, stdev, min_block_size...).
+    # Instances are picklable; reseed each copy (e.g. in a DataLoader
+    # worker_init_fn) so that workers do not draw the same noise.
+    def __init__(self, charset_probs, seed=None, **options):
+        self.args = argparser(inputs=False).parse_args(['--charset-probs', charset_probs])
+        for name, value in options.items():
+            if name not in vars(self.args) or name in ('charset_probs', 'seed'):
+                raise TypeError(f"OCRNoiser got an unexpected option '{name}'")
+            setattr(self.args, name, value)
+        self.args.seed = seed
+        self.model = load_model(self.args)
+        self.noise_text = ENGINES[self.args.engine]
+        self.rng = np.random.default_rng(seed)
+
+    def reseed(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def noise(self, text):
+        return self.noise_text(text, self.rng, self.args, self.model)
+
+    def noise_batch(self, texts):
+        return [self.noise(text) for text in texts]
+
+    def noise_iter(self, texts):
+        for text in texts:
+            yield self.noise(text)
+
+def get_document_rng(seed_seq, file_index, line_index, variant):
+    # Every variant of every document has its own stream, so the output does
+    # not depend on the order in which documents are noised
+    return np.random.default_rng(np.random.SeedSequence(seed_seq.entropy, spawn_key=(file_index, line_index, variant)))
+
+def read_lines(jsonl_files):
+    for file_index, fn in enumerate(jsonl_files):
+        for line_index, line in enumerate(JSONL_io.read_lines(fn)):
+            yield file_index, line_index, line
+
+worker_state = {}
+
+def init_worker(args, model, seed_seq):
+    # The workers map a cached model file rather than receiving a copy
+    if isinstance(model, str):
+        model = NoiseModel.load(model)
+    worker_state['args'] = args
+    worker_state['model'] = model
+    worker_state['seed_seq'] = seed_seq
+    worker_state['noise'] = ENGINES[args.engine]
+
+def noise_line(item):
+    file_index, line_index, line = item
+    args = worker_state['args']
+    stats = None if args.stats is None else NoiseStats()
+    start = time.perf_counter()
+    indata = JSONL_io.loads(line)
+    text = indata['text']
+    if stats is not None:
+        start = stats.add_time('parse', start)
+    prepared = prepare_text(text)
+    if stats is not None:
+        start = stats.add_time('segment', start)
+        stats.documents += 1
+    outlines = []
+    for variant in range(args.variants):
+        rng = get_document_rng(worker_state['seed_seq'], file_index, line_index, variant)
+        noised = worker_state['noise'](text, rng, args, worker_state['model'], prepared, stats)
+        if stats is not None:
+            start = stats.add_time('noise', start)
+        outdata = { 'input': noised, 'output': text }
+        outlines.append(JSONL_io.dumpb(outdata))
+        if stats is not None:
+            start = stats.add_time('serialize', start)
+    return outlines, stats
+
+def timed_blocks(blocks, stats):
+    # Only the time spent producing the blocks counts as noise, the rest of
+    # the streamed write is timed by the caller
+    start = time.perf_counter()
+    for block in blocks:
+        stats.add_time('noise', start)
+        yield block
+        start = time.perf_counter()
+    stats.add_time('noise', start)
+
+def stream_line(item, writer, stats):
+    # Same output as noise_line, but the noised text is written block by
+    # block instead of being built in memory first, and only the current
+    # block is ever held as code points
+    file_index, line_index, line = item
+    args = worker_state['args']
+    line_stats = None if stats is None else NoiseStats()
+    start = time.perf_counter()
+    text = JSONL_io.loads(line)['text']
+    if line_stats is not None:
+        start = line_stats.add_time('parse', start)
+    # Without a prepared text, the blocks are found and converted to code
+    # points one at a time, which is then counted as noise
+    for variant in range(args.variants):
+        rng = get_document_rng(worker_state['seed_seq'], file_index, line_index, variant)
+        blocks = BLOCK_ENGINES[args.engine](text, rng, args, worker_state['model'], None, line_stats)
+        if line_stats is None:
+            writer.write_streamed('input', blocks, { 'output': text })
+            continue
+        start = line_stats.add_time('noise', start)
+        noise_seconds = line_stats.seconds['noise']
+        writer.write_streamed('input', timed_blocks(blocks, line_stats), { 'output': text })
+        # Serializing and writing the blocks are both counted as write
+        end = time.perf_counter()
+        line_stats.seconds['write'] += end - start - (line_stats.seconds['noise'] - noise_seconds)
+        start = end
+    if stats is not None:
+        line_stats.documents += 1
+        stats.merge(line_stats)
+
+def write_lines(writer, results, stats):
+    for outlines, line_stats in results:
+        if stats is None:
+            for outline in outlines:
+                writer.write_line(outline)
+        else:
+            stats.merge(line_stats)
+            start = time.perf_counter()
+            for outline in outlines:
+                writer.write_line(outline)
+            stats.add_time('write', start)
 
 def main(argv):
-    args = argparser().parse_args()
+    if len(argv) > 1 and argv[1] == 'serve':
+        import OCR_noise_server
+        return OCR_noise_server.main(argv[1:])
+    ap = argparser()
+    args = ap.parse_args()
+    if args.stream and args.workers > 1:
+        ap.error("--stream cannot be used with --workers")
     
-    with open(args.charset_probs) as probs_file:
-        probs_dict = {}
-        for line in probs_file:
-            data = json.loads(line)
-            char = list(data.keys())[0]
-            probs_dict[char] = data[char]
+    seed_seq = np.random.SeedSequence(args.seed)
     
-    rng = np.random.default_rng(args.seed)
-    
-    default_charset = set_default_char(args)
-    
-    other_chars = set_other_chars(probs_dict, default_charset)
+    model = load_model(args)
     
     #for i, c in enumerate(sorted(other_chars)):
     #    sys.stderr.write(f"{c}[{c.encode('raw_unicode_escape')}] - {i}\n")
@@ -160,15 +414,25 @@ def main(argv):
     #    sys.stderr.write(f"{c}")
     #sys.stderr.write("\n")
         
-    for fn in args.jsonl:
-        with open(fn) as f:
-            for line in tqdm(f, desc="Texts"):
-                indata = json.loads(line)
-                text = indata['text']
-                noised = add_noise(text, rng, args, probs_dict, other_chars)
-                outdata = { 'input': noised, 'output': text }
-                print(json.dumps(outdata, ensure_ascii=False))
+    stats = None if args.stats is None else NoiseStats()
+    start = time.perf_counter()
+    
+    lines = read_lines(args.jsonl)
+    with JSONL_io.JSONLWriter.open(args.output) as writer:
+        if args.workers > 1:
+            with Pool(args.workers, initializer=init_worker, initargs=(args, model.path or model, seed_seq)) as pool:
+                write_lines(writer, tqdm(pool.imap(noise_line, lines, chunksize=64), desc="Texts"), stats)
+        elif args.stream:
+            init_worker(args, model, seed_seq)
+            for item in tqdm(lines, desc="Texts"):
+                stream_line(item, writer, stats)
+        else:
+            init_worker(args, model, seed_seq)
+            write_lines(writer, tqdm(map(noise_line, lines), desc="Texts"), stats)
     
+    if stats is not None:
+        with open(args.stats, 'w') as f:
+            f.write(json.dumps(stats.summary(time.perf_counter() - start), indent=4))
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
\ No newline at end of file
@@ -0,0 +1,122 @@
+import sys
+import json
+import time
+import platform
+import itertools
+import subprocess
+
+import numpy as np
+
+from argparse import ArgumentParser
+
+import JSONL_io
+
+from OCR_noise import OCRNoiser, ENGINES
+
+def argparser():
+    ap = ArgumentParser(description='Measure the throughput of the OCR_noise engines')
+    ap.add_argument('--corpus', default='data_files/ecco_i/test_ocr_noise/wikipedia_20220301.en.devel.split.compare.jsonl')
+    ap.add_argument('--field', default='output', help='Field of the corpus records holding the clean text')
+    ap.add_argument('--charset-probs', nargs='+', default=['data_files/ecco_i/ecco_i_probs.jsonl', 'data_files/ecco_ii/ecco_ii_probs.jsonl'])
+    ap.add_argument('--charsets', nargs='+', default=['data_files/ecco_charset.txt', 'data_files/gallica_charset.txt'])
+    ap.add_argument('--means', type=float, nargs='+', default=[0.05, 0.1, 0.2])
+    ap.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    ap.add_argument('--book-size', type=int, default=1000000, help='Number of characters of the book-length document')
+    ap.add_argument('--repeat', type=int, default=3, help='Number of runs of each configuration, the fastest is kept')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--output', default='-', help='JSON file for the results')
+    ap.add_argument('--baseline', help='Results of a previous run to compare with')
+    ap.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    return ap
+
+def load_corpora(args):
+    paragraphs = [record[args.field] for record in JSONL_io.read_jsonl(args.corpus)]
+    text = ' '.join(paragraphs)
+    book = (text * (args.book_size // max(len(text), 1) + 1))[:args.book_size]
+    return {
+        'paragraphs': paragraphs,
+        'book': [book],
+    }
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(noiser, texts, repeat, seed):
+    seconds = []
+    for _ in range(repeat):
+        noiser.reseed(seed)
+        start = time.perf_counter()
+        for text in texts:
+            noiser.noise(text)
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+def compare(results, baseline, tolerance):
+    key = lambda r: (r['engine'], r['charset_probs'], r['charset'], r['mean'], r['corpus'])
+    previous = {key(r): r for r in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        ratio = result['chars_per_sec'] / old['chars_per_sec']
+        if ratio < 1 - tolerance:
+            regressions += 1
+            sys.stderr.write(f"REGRESSION {key(result)}: {old['chars_per_sec']:.0f} -> {result['chars_per_sec']:.0f} chars/s ({ratio:.2f}x)\n")
+    return regressions
+
+def main(argv):
+    args = argparser().parse_args()
+
+    corpora = load_corpora(args)
+
+    results = []
+    for charset_probs, charset, engine in itertools.product(args.charset_probs, args.charsets, args.engines):
+        for mean in args.means:
+            noiser = OCRNoiser(charset_probs, charset=charset, engine=engine, mean=mean)
+            for corpus, texts in corpora.items():
+                seconds = run_benchmark(noiser, texts, args.repeat, args.seed)
+                chars = sum(len(text) for text in texts)
+                result = {
+                    'engine': engine,
+                    'charset_probs': charset_probs,
+                    'charset': charset,
+                    'mean': mean,
+                    'corpus': corpus,
+                    'docs': len(texts),
+                    'chars': chars,
+                    'seconds': seconds,
+                    'chars_per_sec': chars / seconds,
+                    'docs_per_sec': len(texts) / seconds,
+                }
+                results.append(result)
+                sys.stderr.write(f"{engine:>10} {charset_probs} {charset} mean={mean} {corpus:>10}: {result['chars_per_sec']:12.0f} chars/s {result['docs_per_sec']:10.1f} docs/s\n")
+
+    report = {
+        'commit': get_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'json_backend': JSONL_io.BACKEND,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    if args.output == '-':
+        print(json.dumps(report, indent=4))
+    else:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=4))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,206 @@
+import os
+import json
+
+import numpy as np
+
+OTHER_CHAR = 'OTHER_CHAR'
+SPACE_CHAR = 'SPACE_CHAR'
+
+# Indices of the character distributions in NoiseModel.op_offsets/op_probs/op_codes
+REPLACE = 0
+INSERT = 1
+
+# Code drawn when the original character is kept
+NO_CHAR = 0xFFFFFFFF
+
+# Compiled model files: this line, a JSON header line, then the arrays
+MODEL_MAGIC = b'OCR_noise_model 1\n'
+MODEL_ALIGNMENT = 64
+MODEL_ARRAYS = ('keep', 'delete', 'replace', 'insert', 'delete_replace', 'lookup', 'other_codes', 'other_offsets', 'other_prob', 'other_alias')
+MODEL_ARRAY_LISTS = ('op_offsets', 'op_probs', 'op_aliases', 'op_codes')
+
+def output_char(c):
+    if c != SPACE_CHAR:
+        return c
+    return ' '
+
+def build_alias_table(weights):
+    # Vose's alias method: column k keeps outcome k with probability prob[k]
+    # and falls back to outcome alias[k] otherwise
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+    small = [k for k in range(n) if scaled[k] < 1.0]
+    large = [k for k in range(n) if scaled[k] >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = (scaled[l] + scaled[s]) - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
+
+def get_outcome_weights(distribution):
+    # Mass that the cumulative walk over the distribution gives to each
+    # character, plus the remaining mass for which it falls back to the
+    # original character
+    cdf = np.cumsum(np.fromiter(distribution.values(), dtype=np.float64, count=len(distribution)))
+    cdf = np.minimum(cdf, 1.0)
+    weights = np.diff(cdf, prepend=0.0)
+    return np.append(weights, 1.0 - (cdf[-1] if len(cdf) else 0.0))
+
+def align(offset):
+    return -(-offset // MODEL_ALIGNMENT) * MODEL_ALIGNMENT
+
+def get_codes(text):
+    # View of the text as an array of code points
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+def get_text(codes):
+    return codes.tobytes().decode('utf-32-le', 'surrogatepass')
+
+def build_alias_tables(distributions):
+    offsets = np.zeros(len(distributions) + 1, dtype=np.int64)
+    probs, aliases, codes = [], [], []
+    for i, distribution in enumerate(distributions):
+        prob, alias = build_alias_table(get_outcome_weights(distribution))
+        offsets[i + 1] = offsets[i] + len(prob)
+        probs.append(prob)
+        aliases.append(alias + offsets[i])
+        codes.extend(ord(output_char(c)) for c in distribution)
+        codes.append(NO_CHAR)
+    return offsets, np.concatenate(probs), np.concatenate(aliases), np.array(codes, dtype=np.uint32)
+
+def sample_alias(u, offsets, prob, alias, rows):
+    sizes = offsets[rows + 1] - offsets[rows]
+    u = u * sizes
+    column = np.minimum(u.astype(np.int64), sizes - 1)
+    j = offsets[rows] + column
+    return np.where(u - column < prob[j], j, alias[j])
+
+class NoiseModel:
+    # Index 0 is OTHER_CHAR, the working row of every character that is
+    # not in the probabilities file or that is never modified (KEEP == 1)
+    def __init__(self, probs_dict, other_chars, other_char_prob):
+        self.path = None
+        self.other_char_prob = other_char_prob
+        self.chars = [OTHER_CHAR] + [c for c in probs_dict if len(c) == 1 and probs_dict[c]['KEEP'] != 1]
+        self.index = {ord(c): i for i, c in enumerate(self.chars) if i > 0}
+        # Row of every code point up to the largest known one, the last
+        # entry (OTHER_CHAR) stands for all the code points above
+        self.lookup = np.zeros(max(self.index, default=0) + 2, dtype=np.int32)
+        for code, i in self.index.items():
+            self.lookup[code] = i
+        rows = [probs_dict[c] for c in self.chars]
+        self.keep = np.array([row['KEEP'] for row in rows], dtype=np.float64)
+        self.delete = np.array([row['DELETE'] for row in rows], dtype=np.float64)
+        self.replace = np.array([row['REPLACE'] for row in rows], dtype=np.float64)
+        self.insert = np.array([row['INSERT'] for row in rows], dtype=np.float64)
+        self.delete_replace = self.delete + self.replace
+        self.op_offsets, self.op_probs, self.op_aliases, self.op_codes = [], [], [], []
+        for op in ('REPLACE_CHAR', 'INSERT_CHAR'):
+            offsets, prob, alias, codes = build_alias_tables([row[op] for row in rows])
+            self.op_offsets.append(offsets)
+            self.op_probs.append(prob)
+            self.op_aliases.append(alias)
+            self.op_codes.append(codes)
+        self.other_codes = np.array([ord(output_char(c)) for c in other_chars], dtype=np.uint32)
+        self.other_offsets = np.array([0, len(self.other_codes)], dtype=np.int64)
+        self.other_prob, self.other_alias = build_alias_table(np.ones(len(self.other_codes)))
+
+    def get_arrays(self):
+        arrays = {name: getattr(self, name) for name in MODEL_ARRAYS}
+        for name in MODEL_ARRAY_LISTS:
+            for op, array in enumerate(getattr(self, name)):
+                arrays[f'{name}_{op}'] = array
+        return arrays
+
+    def save(self, path):
+        # The file is written under a temporary name first so that
+        # concurrent jobs never load a partial model
+        arrays = self.get_arrays()
+        header = {'other_char_prob': self.other_char_prob, 'arrays': {}}
+        offsets = {}
+        offset = 0
+        for name, array in arrays.items():
+            offsets[name] = offset
+            header['arrays'][name] = [array.dtype.str, array.shape, offset]
+            offset = align(offset + array.nbytes)
+        header = json.dumps(header).encode('utf-8') + b'\n'
+        data_start = align(len(MODEL_MAGIC) + len(header))
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MODEL_MAGIC + header)
+            for name, array in arrays.items():
+                f.seek(data_start + offsets[name])
+                f.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        # The arrays are read-only views on a memory map of the file, shared
+        # by all the processes that load it
+        with open(path, 'rb') as f:
+            if f.readline() != MODEL_MAGIC:
+                raise ValueError(f"{path} is not a compiled noise model")
+            header = json.loads(f.readline())
+            data_start = align(f.tell())
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            start = data_start + offset
+            size = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            arrays[name] = data[start:start + size].view(dtype).reshape(tuple(shape))
+        model = cls.__new__(cls)
+        model.path = path
+        model.other_char_prob = header['other_char_prob']
+        for name in MODEL_ARRAYS:
+            setattr(model, name, arrays[name])
+        for name in MODEL_ARRAY_LISTS:
+            setattr(model, name, [arrays[f'{name}_{op}'] for op in (REPLACE, INSERT)])
+        rows = np.flatnonzero(model.lookup)
+        model.index = dict(zip(rows.tolist(), model.lookup[rows].tolist()))
+        return model
+
+    def get_index(self, c):
+        return self.index.get(ord(c), 0)
+
+    def get_indices(self, codes):
+        return self.lookup[np.minimum(codes, len(self.lookup) - 1)]
+
+    def sample_op_char(self, rng, op, i):
+        start = self.op_offsets[op][i]
+        size = self.op_offsets[op][i + 1] - start
+        u = rng.random() * size
+        column = min(int(u), size - 1)
+        j = start + column
+        if u - column >= self.op_probs[op][j]:
+            j = self.op_aliases[op][j]
+        return int(self.op_codes[op][j])
+
+    def sample_other_char(self, rng):
+        size = len(self.other_codes)
+        u = rng.random() * size
+        column = min(int(u), size - 1)
+        if u - column >= self.other_prob[column]:
+            column = self.other_alias[column]
+        return int(self.other_codes[column])
+
+    def sample_op_codes(self, rng, op, rows):
+        # Code points drawn for the rows, NO_CHAR meaning that the original
+        # character is kept
+        u = rng.random(len(rows))
+        j = sample_alias(u, self.op_offsets[op], self.op_probs[op], self.op_aliases[op], rows)
+        return self.op_codes[op][j]
+
+    def sample_other_codes(self, rng, n):
+        u = rng.random(n)
+        j = sample_alias(u, self.other_offsets, self.other_prob, self.other_alias, np.zeros(n, dtype=np.int64))
+        return self.other_codes[j]
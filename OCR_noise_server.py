@@ -0,0 +1,133 @@
+import os
+import sys
+import stat
+import queue
+import signal
+import socket
+import argparse
+import itertools
+import threading
+import socketserver
+
+import numpy as np
+
+from multiprocessing import Pool
+
+import JSONL_io
+
+from OCR_noise import argparser, load_model, init_worker, worker_state, get_document_rng, prepare_text, ENGINES
+
+# Options that a request can override, e.g.
+#   {"id": 7, "text": "...", "seed": 0, "mean": 0.2}
+REQUEST_OPTIONS = ('mean', 'stdev', 'min_error_prob', 'max_error_prob', 'min_block_size', 'max_block_size', 'variants', 'engine')
+# Number of requests of a connection being noised or waiting to be sent back
+MAX_PENDING = 1024
+
+def init_server_worker(args, model, seed_seq):
+    # Interrupting the server stops it, the workers are then terminated
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(args, model, seed_seq)
+
+def serve_line(item):
+    connection_index, request_index, line = item
+    request = None
+    try:
+        request = JSONL_io.loads(line)
+        text = request['text']
+        args = worker_state['args']
+        options = {name: request[name] for name in REQUEST_OPTIONS if name in request}
+        if options:
+            args = argparse.Namespace(**{**vars(args), **options})
+        # With its own seed, a request is noised like the first line of an
+        # input file of OCR_noise.py --seed
+        if 'seed' in request:
+            seed_seq, key = np.random.SeedSequence(request['seed']), (0, 0)
+        else:
+            seed_seq, key = worker_state['seed_seq'], (connection_index, request_index)
+        prepared = prepare_text(text)
+        noised = [ENGINES[args.engine](text, get_document_rng(seed_seq, *key, variant), args, worker_state['model'], prepared) for variant in range(args.variants)]
+        response = { 'input': noised[0] if args.variants == 1 else noised, 'output': text }
+    except Exception as e:
+        response = { 'error': f"{type(e).__name__}: {e}" }
+    if isinstance(request, dict) and 'id' in request:
+        response['id'] = request['id']
+    return JSONL_io.dumpb(response) + b'\n'
+
+class NoiseRequestHandler(socketserver.StreamRequestHandler):
+    # The requests are read and handed to the pool as they come, while the
+    # responses are sent back in the order of the requests
+    def handle(self):
+        connection_index = next(self.server.connections)
+        results = queue.Queue(MAX_PENDING)
+        def submit():
+            try:
+                for request_index, line in enumerate(self.rfile):
+                    if line.strip():
+                        results.put(self.server.pool.apply_async(serve_line, ((connection_index, request_index, line),)))
+            except OSError:
+                pass
+            results.put(None)
+        thread = threading.Thread(target=submit, daemon=True)
+        thread.start()
+        try:
+            while (result := results.get()) is not None:
+                self.wfile.write(result.get())
+        finally:
+            while thread.is_alive():
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+def noise_texts(socket_path, texts, **options):
+    # Client of the server: yields the noised texts in order, the requests
+    # being sent from another thread so that they are pipelined
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        def send():
+            with sock.makefile('wb') as f:
+                for text in texts:
+                    f.write(JSONL_io.dumpb({ 'text': text, **options }) + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+        thread = threading.Thread(target=send, daemon=True)
+        thread.start()
+        with sock.makefile('rb') as f:
+            for line in f:
+                response = JSONL_io.loads(line)
+                if 'error' in response:
+                    raise ValueError(response['error'])
+                yield response['input']
+        thread.join()
+
+def remove_socket(path):
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+
+def main(argv):
+    ap = argparser(inputs=False)
+    ap.prog = 'OCR_noise.py serve'
+    ap.description = 'Noise the texts sent as JSON lines to a Unix socket'
+    ap.add_argument('--socket', required=True, help='Path of the Unix socket to listen on')
+    args = ap.parse_args(argv[1:])
+
+    seed_seq = np.random.SeedSequence(args.seed)
+    model = load_model(args)
+
+    # Left behind by a server that was killed
+    remove_socket(args.socket)
+    with Pool(args.workers, initializer=init_server_worker, initargs=(args, model.path or model, seed_seq)) as pool:
+        with socketserver.ThreadingUnixStreamServer(args.socket, NoiseRequestHandler) as server:
+            server.daemon_threads = True
+            server.pool = pool
+            server.connections = itertools.count()
+            sys.stderr.write(f"Serving on {args.socket}\n")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                remove_socket(args.socket)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+
+STAGES = ('parse', 'segment', 'noise', 'serialize', 'write')
+# Bins of the per-block character error rate histogram
+ERROR_RATE_BINS = np.linspace(0.0, 1.0, 51)
+
+class NoiseStats:
+    def __init__(self):
+        self.documents = 0
+        self.blocks = 0
+        self.chars = 0
+        self.noised_chars = 0
+        self.deleted = 0
+        self.replaced = 0
+        self.inserted = 0
+        self.other_chars = 0
+        self.error_rates = np.zeros(len(ERROR_RATE_BINS) - 1, dtype=np.int64)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    def add_block(self, size, deleted, replaced, inserted):
+        deleted, replaced, inserted = int(deleted), int(replaced), int(inserted)
+        self.blocks += 1
+        self.chars += size
+        self.noised_chars += size - deleted + inserted
+        self.deleted += deleted
+        self.replaced += replaced
+        self.inserted += inserted
+        error_rate = (deleted + replaced + inserted) / size
+        self.error_rates[min(int(error_rate * len(self.error_rates)), len(self.error_rates) - 1)] += 1
+
+    def add_time(self, stage, start):
+        end = time.perf_counter()
+        self.seconds[stage] += end - start
+        return end
+
+    def merge(self, other):
+        self.documents += other.documents
+        self.blocks += other.blocks
+        self.chars += other.chars
+        self.noised_chars += other.noised_chars
+        self.deleted += other.deleted
+        self.replaced += other.replaced
+        self.inserted += other.inserted
+        self.other_chars += other.other_chars
+        self.error_rates += other.error_rates
+        for stage in STAGES:
+            self.seconds[stage] += other.seconds[stage]
+
+    def summary(self, wall_seconds):
+        edits = self.deleted + self.replaced + self.inserted
+        return {
+            'documents': self.documents,
+            'blocks': self.blocks,
+            'chars': self.chars,
+            'noised_chars': self.noised_chars,
+            'wall_seconds': wall_seconds,
+            'chars_per_sec': self.chars / wall_seconds if wall_seconds else None,
+            'docs_per_sec': self.documents / wall_seconds if wall_seconds else None,
+            'char_error_rate': edits / self.chars if self.chars else None,
+            'ops': {
+                'DELETE': self.deleted,
+                'REPLACE': self.replaced,
+                'INSERT': self.inserted,
+            },
+            'other_char_draws': self.other_chars,
+            # Summed over the worker processes
+            'stage_seconds': self.seconds,
+            'block_error_rate_histogram': {
+                'bins': ERROR_RATE_BINS.tolist(),
+                'counts': self.error_rates.tolist(),
+            },
+        }
@@ -0,0 +1,61 @@
+import numpy as np
+
+from OCR_noise_model import get_codes
+from text_preprocessing import PRINTABLE_TABLE
+
+# Number of characters of text buffered before they are counted at once
+CHUNK_CHARS = 1 << 22
+
+class CharCounts:
+    # Occurrences of every code point, counted over chunks of text as
+    # arrays of code points; the characters that keep_printable removes are
+    # only filtered out of the final frequencies
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.texts = []
+        self.buffered = 0
+
+    def __getstate__(self):
+        # Only the code points seen are sent between processes
+        self.flush()
+        codes = np.flatnonzero(self.counts)
+        return { 'codes': codes, 'counts': self.counts[codes] }
+
+    def __setstate__(self, state):
+        self.__init__()
+        if len(state['codes']):
+            self.resize(int(state['codes'][-1]) + 1)
+            self.counts[state['codes']] = state['counts']
+
+    def resize(self, size):
+        if size > len(self.counts):
+            counts = np.zeros(size, dtype=np.int64)
+            counts[:len(self.counts)] = self.counts
+            self.counts = counts
+
+    def add_text(self, text):
+        self.texts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= CHUNK_CHARS:
+            self.flush()
+
+    def flush(self):
+        if not self.texts:
+            return
+        counts = np.bincount(get_codes(''.join(self.texts)))
+        self.texts = []
+        self.buffered = 0
+        self.resize(len(counts))
+        self.counts[:len(counts)] += counts
+
+    def merge(self, other):
+        other.flush()
+        self.resize(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+
+    def get_frequencies(self):
+        # Occurrences of the characters that keep_printable keeps, by
+        # character, each code point seen being classified once
+        self.flush()
+        codes = np.flatnonzero(self.counts)
+        return {chr(code): count for code, count in zip(codes.tolist(), self.counts[codes].tolist()) if PRINTABLE_TABLE[code] is not None}
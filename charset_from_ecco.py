@@ -1,35 +1,34 @@
 import sys
-import json
 import gzip
 import subprocess
 import os
 import re
-import unicodedata
 import time
 
 import numpy as np
 
 from argparse import ArgumentParser
-from collections import Counter
 from multiprocessing import Pool, Lock
 
+import JSONL_io
+
+from charset_counts import CharCounts
+
 def argparser():
     ap = ArgumentParser()
     ap.add_argument('input_dir', help='Input directory with jsonl files')
     ap.add_argument('--processes', type=int, default=4, help='Number of processes to use')
+    ap.add_argument('--frequencies', help='JSONL file for the number of occurrences of every character of the charset')
     return ap
 
 def update_charset(charset, text):
-    prepared_text = ''.join(c for c in text if unicodedata.category(c) == 'Zs' or c.isprintable())
-    charset.update(prepared_text)
+    charset.add_text(text)
 
 def process_file(jsonl_file):
-    charset = Counter()
-    with open(jsonl_file, 'r') as f:
-        for line in f:
-            indata = json.loads(line)
-            text = indata['text']
-            update_charset(charset, text)
+    charset = CharCounts()
+    for indata in JSONL_io.read_jsonl(jsonl_file):
+        text = indata['text']
+        update_charset(charset, text)
     return charset
 
 def update_progress(p, start_time):
@@ -47,21 +46,23 @@ def main(argv):
     
     start_time = time.time()
     
+    # The counts of every file are merged as soon as they arrive
+    charset = CharCounts()
     with Pool(processes=args.processes) as pool:
-        charsets = []
-        for i, charset in enumerate(pool.imap_unordered(process_file, jsonl_files)):
+        for i, file_charset in enumerate(pool.imap_unordered(process_file, jsonl_files)):
             update_progress((i+1) / len(jsonl_files), start_time)
-            charsets.append(charset)
+            charset.merge(file_charset)
     
-    charset = Counter()
-    for cs in charsets:
-        charset.update(cs)
-    chars = sorted(charset.keys())
+    frequencies = charset.get_frequencies()
+    chars = sorted(frequencies)
     
     for c in chars:
         print(c, end='')
         sys.stderr.write(f"{c}")
     sys.stderr.write("\n")
+    
+    if args.frequencies is not None:
+        JSONL_io.write_jsonl(args.frequencies, ({ 'char': c, 'count': frequencies[c] } for c in chars))
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
\ No newline at end of file
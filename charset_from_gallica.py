@@ -1,10 +1,8 @@
 import sys
-import json
 import gzip
 import subprocess
 import os
 import re
-import unicodedata
 import time
 import glob
 
@@ -12,26 +10,28 @@ import numpy as np
 
 from tqdm import tqdm
 from argparse import ArgumentParser
-from collections import Counter
 from multiprocessing import Pool, Lock
 
+import JSONL_io
+
+from charset_counts import CharCounts
+
 def argparser():
     ap = ArgumentParser()
     ap.add_argument('jsonl', nargs='+', help='Input directory with jsonl files')
     ap.add_argument('--processes', type=int, default=4, help='Number of processes to use')
+    ap.add_argument('--frequencies', help='JSONL file for the number of occurrences of every character of the charset')
     return ap
 
 def update_charset(charset, text):
-    prepared_text = ''.join(c for c in text if unicodedata.category(c) == 'Zs' or c.isprintable())
-    charset.update(prepared_text)
+    charset.add_text(text)
 
 def process_file(jsonl_file):
-    charset = Counter()
-    with gzip.open(jsonl_file, 'r') as f:
+    charset = CharCounts()
+    with gzip.open(jsonl_file, 'rb') as f:
         next(f)
         next(f)
-        for line in tqdm(f, desc="Texts"):
-            indata = json.loads(line)
+        for indata in tqdm(JSONL_io.iter_jsonl(f), desc="Texts"):
             text = indata['text']
             update_charset(charset, text)
     return charset
@@ -60,21 +60,23 @@ def main(argv):
     
     start_time = time.time()
     
+    # The counts of every file are merged as soon as they arrive
+    charset = CharCounts()
     with Pool(processes=args.processes) as pool:
-        charsets = []
-        for i, charset in enumerate(pool.imap_unordered(process_file, jsonl_files)):
+        for i, file_charset in enumerate(pool.imap_unordered(process_file, jsonl_files)):
             update_progress((i+1) / len(jsonl_files), start_time)
-            charsets.append(charset)
+            charset.merge(file_charset)
     
-    charset = Counter()
-    for cs in charsets:
-        charset.update(cs)
-    chars = sorted(charset.keys())
+    frequencies = charset.get_frequencies()
+    chars = sorted(frequencies)
     
     for c in chars:
         print(c, end='')
         sys.stderr.write(f"{c}")
     sys.stderr.write("\n")
+    
+    if args.frequencies is not None:
+        JSONL_io.write_jsonl(args.frequencies, ({ 'char': c, 'count': frequencies[c] } for c in chars))
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
\ No newline at end of file
@@ -1,76 +1,60 @@
 import Levenshtein as LV
 import json
-import pandas as pd
 import csv
 import sys
 import os
-import re
-import unicodedata
 
 from glob import glob
 from tqdm import tqdm
 from argparse import ArgumentParser
 
 import OCR_errors_JSON_generator_functions as ocr
+import JSONL_io
+
+from text_preprocessing import preprocessing_text
 
 def argparser():
     ap = ArgumentParser()
     ap.add_argument('jsonl', nargs='+')
     ap.add_argument('--charset', required=True)
     ap.add_argument('--output-jsonl', required=True)
+    ap.add_argument('--workers', type=int, default=1)
+    ap.add_argument('--long-pair-length', type=int, default=ocr.LONG_PAIR_LENGTH, help='Pairs longer than this many characters (e.g. 10000) are aligned between anchor words instead of as a whole; by default every pair is aligned as a whole')
+    ap.add_argument('--counts', help='JSONL file for the raw counts, to merge with other counts using OCR_errors_counts.py')
+    ocr.add_alignment_cache_arguments(ap)
+    ocr.add_convergence_arguments(ap)
     return ap
 
-def preprocessing_text(text):
-    text = re.sub('[\n\t]', ' ', text)
-    text = text.strip()
-    text = re.sub(' +', ' ', text)
-    text = ''.join(c for c in text if unicodedata.category(c) == 'Zs' or c.isprintable())
-    return text
-
-def get_dataframe(jsonl_files):
-    l = []
+def iter_pairs(jsonl_files):
     for jsonl_file in jsonl_files:
-        with open(jsonl_file, 'rt', encoding='utf-8') as f:
-            for line in f:
-                json_obj = json.loads(line)
-                l.append((preprocessing_text(json_obj.get('input')), preprocessing_text(json_obj.get('output'))))
-    columns = ['input', 'output']
-    return pd.DataFrame(l, columns=columns)
-
-def add_charset(charset_name, json_content):
-    with open(charset_name, 'r') as charset:
-        while (char := charset.read(1)):
-            ocr.update_unknown_char(json_content, char, 1, 1)
-    return json_content
+        for json_obj in JSONL_io.read_jsonl(jsonl_file):
+            yield preprocessing_text(json_obj.get('input')), preprocessing_text(json_obj.get('output'))
 
-def add_data(df, json_content):
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Data processing   ", unit=" pairs"):
-        ocr.add_data_to_json(row['input'], row['output'], json_content)
+def add_data(pairs, json_content, workers=1, long_pair_length=ocr.LONG_PAIR_LENGTH, monitor=None, cache_path=None, cache_size=ocr.alignment_cache.CACHE_SIZE):
+    with tqdm(desc="Data processing   ", unit=" pairs") as progress:
+        ocr.add_pairs_to_json(pairs, json_content, workers, progress, long_pair_length, monitor, cache_path, cache_size)
     return json_content
 
-def save_data(json_content, output_jsonl):
-    with open(output_jsonl, 'w', encoding='utf-8') as json_file:
-        json_file.write(json.dumps(json_content, indent=4))
-        
-
 def main(argv):
     args = argparser().parse_args()
     jsonl_files = args.jsonl
     charset_name = args.charset
     output_jsonl = args.output_jsonl
     
-    df = get_dataframe(jsonl_files)
-    
     json_content = {}
-    ocr.init_json_file(df, json_content)
+    ocr.update_unknown_char(json_content, 'OTHER_CHAR')
     
-    json_content = add_charset(charset_name, json_content)
+    pairs = iter_pairs(jsonl_files)
+    if args.until_converged:
+        pairs = ocr.shuffle_pairs(pairs, args.shuffle_buffer, args.seed)
     
-    json_content = add_data(df, json_content)
-    save_data(json_content, output_jsonl)
+    json_content = add_data(pairs, json_content, args.workers, args.long_pair_length, ocr.get_convergence_monitor(args), args.alignment_cache, args.alignment_cache_size << 20)
+    if args.counts is not None:
+        ocr.write_json_content(json_content, args.counts)
     
-    ocr.int_to_probabilities(output_jsonl)
-    ocr.json2jsonl(output_jsonl, output_jsonl)
+    # The charset only adds the characters never seen in the pairs
+    ocr.add_charset(json_content, charset_name)
+    ocr.write_probabilities(json_content, output_jsonl)
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
\ No newline at end of file
@@ -0,0 +1,31 @@
+import re
+import unicodedata
+
+# Tabs and newlines become spaces and runs of spaces a single one
+WHITESPACE_RE = re.compile('[ \n\t]{2,}|[\n\t]')
+
+class PrintableTable(dict):
+    # str.translate table deleting the characters that are neither printable
+    # nor spaces (Zs), every code point being classified the first time it
+    # is met
+    def __missing__(self, code):
+        c = chr(code)
+        value = code if unicodedata.category(c) == 'Zs' or c.isprintable() else None
+        self[code] = value
+        return value
+
+PRINTABLE_TABLE = PrintableTable()
+
+def keep_printable(text):
+    if text.isprintable():
+        return text
+    return text.translate(PRINTABLE_TABLE)
+
+def preprocessing_text(text):
+    if '\n' in text or '\t' in text or '  ' in text:
+        text = WHITESPACE_RE.sub(' ', text)
+    text = text.strip()
+    return keep_printable(text)
+
+def preprocessing_texts(texts):
+    return [preprocessing_text(text) for text in texts]